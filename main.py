@@ -1,25 +1,52 @@
 import os
-from fastapi import FastAPI, HTTPException
+import asyncio
+import gzip
+import logging
+import re
+import threading
+import time
+from functools import lru_cache
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime, timezone
+from pymongo.errors import BulkWriteError, OperationFailure
+from bson import ObjectId
+import orjson
 
 # Database helpers
-from database import db, create_document, get_documents
+from database import db, create_document, create_documents, aggregate_documents
 
-app = FastAPI(title="NutriTailor AI Backend", version="1.0.0")
+logger = logging.getLogger(__name__)
+
+_UTC = timezone.utc
+GZIP_MIN_SIZE = 1024
+
+
+app = FastAPI(title="NutriTailor AI Backend", version="1.0.0", default_response_class=ORJSONResponse)
+
+# Comma-separated frontend origins, e.g. "https://nutritailor.app,http://localhost:3000"
+cors_origins = [o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip()]
+if not cors_origins:
+    logger.warning("CORS_ORIGINS is not set; allowing requests from any origin")
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=cors_origins or ["*"],
+    # credentials are only valid with an explicit origin list
+    allow_credentials=bool(cors_origins),
+    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_headers=["Content-Type", "Authorization"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE)
 
 
 class ChatRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid", str_strip_whitespace=True)
+
     message: str = Field(..., min_length=1, description="User message")
     session_id: Optional[str] = Field(None, description="Conversation session id")
     context: Optional[Dict[str, Any]] = None
@@ -28,14 +55,23 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     reply: str
     session_id: str
-    timestamp: datetime
+    timestamp: str = Field(..., description="ISO-8601 UTC time")
 
 
 class OrderRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid", str_strip_whitespace=True)
+
     product_id: str
     quantity: int = Field(1, ge=1, le=20)
     email: Optional[str] = None
 
+    @field_validator("product_id")
+    @classmethod
+    def _valid_object_id(cls, v: str) -> str:
+        if not ObjectId.is_valid(v):
+            raise ValueError("invalid product_id")
+        return v
+
 
 @app.get("/")
 def read_root():
@@ -43,7 +79,8 @@ def read_root():
 
 
 @app.get("/test")
-def test_database():
+async def test_database(full: bool = False):
+    """Health check; pass ?full=1 to also list collections (heavier catalog walk)."""
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -56,8 +93,9 @@ def test_database():
     try:
         if db is not None:
             response["database"] = "✅ Available"
-            collections = db.list_collection_names()
-            response["collections"] = collections
+            await db.command("ping")
+            if full:
+                response["collections"] = await db.list_collection_names()
             response["connection_status"] = "Connected"
             response["database"] = "✅ Connected & Working"
         else:
@@ -68,60 +106,120 @@ def test_database():
     return response
 
 
+# Aggregation stages that expose a document's ObjectId as a string "id"
+ID_AS_STRING = [{"$addFields": {"id": {"$toString": "$_id"}}}, {"$project": {"_id": 0}}]
+
+
 # -------- Products (Ecommerce) --------
-@app.get("/api/products")
-def list_products() -> List[dict]:
-    """Return a list of products. If empty, seed with a few defaults."""
-    products = get_documents("product") if db else []
-    if not products and db is not None:
-        seed = [
-            {
-                "title": "Personalized Meal Plan",
-                "description": "A 4-week tailored plan based on your goals and preferences.",
-                "price": 49.0,
-                "category": "plans",
-                "in_stock": True,
-                "image": "https://images.unsplash.com/photo-1543353071-087092ec393a?w=1200&q=80&auto=format&fit=crop",
-            },
-            {
-                "title": "1:1 Nutrition Coaching (60 min)",
-                "description": "Work directly with our AI-guided nutritionist and human expert.",
-                "price": 89.0,
-                "category": "coaching",
-                "in_stock": True,
-                "image": "https://images.unsplash.com/photo-1512621776951-a57141f2eefd?w=1200&q=80&auto=format&fit=crop",
-            },
-            {
-                "title": "Grocery List Optimizer",
-                "description": "Weekly optimized grocery list aligned to macros and budget.",
-                "price": 15.0,
-                "category": "tools",
-                "in_stock": True,
-                "image": "https://images.unsplash.com/photo-1511690656952-34342bb7c2f2?w=1200&q=80&auto=format&fit=crop",
-            },
-        ]
-        for p in seed:
-            create_document("product", p)
-        products = get_documents("product")
-    # Convert ObjectId to str
-    for p in products:
-        if "_id" in p:
-            p["id"] = str(p.pop("_id"))
-    return products
+SEED_PRODUCTS = [
+    {
+        "title": "Personalized Meal Plan",
+        "description": "A 4-week tailored plan based on your goals and preferences.",
+        "price": 49.0,
+        "category": "plans",
+        "in_stock": True,
+        "image": "https://images.unsplash.com/photo-1543353071-087092ec393a?w=1200&q=80&auto=format&fit=crop",
+    },
+    {
+        "title": "1:1 Nutrition Coaching (60 min)",
+        "description": "Work directly with our AI-guided nutritionist and human expert.",
+        "price": 89.0,
+        "category": "coaching",
+        "in_stock": True,
+        "image": "https://images.unsplash.com/photo-1512621776951-a57141f2eefd?w=1200&q=80&auto=format&fit=crop",
+    },
+    {
+        "title": "Grocery List Optimizer",
+        "description": "Weekly optimized grocery list aligned to macros and budget.",
+        "price": 15.0,
+        "category": "tools",
+        "in_stock": True,
+        "image": "https://images.unsplash.com/photo-1511690656952-34342bb7c2f2?w=1200&q=80&auto=format&fit=crop",
+    },
+]
+
+
+@app.on_event("startup")
+async def seed_products():
+    """Seed the catalog once at boot; the unique title index makes this race-safe."""
+    if db is None:
+        return
+    try:
+        try:
+            await db["product"].create_index("title", unique=True)
+            indexed = True
+        except OperationFailure:
+            # e.g. duplicate titles left behind by the old in-request seeding
+            logger.exception("Could not build unique product.title index; seeding with upserts")
+            indexed = False
+        if await db["product"].find_one({}, {"_id": 1}) is None:
+            if indexed:
+                try:
+                    await create_documents("product", SEED_PRODUCTS, ordered=False)
+                except BulkWriteError as e:
+                    # another worker seeded concurrently; only duplicate-key rejections are expected
+                    if e.details.get("writeConcernErrors") or any(
+                        err.get("code") != 11000 for err in e.details.get("writeErrors", [])
+                    ):
+                        raise
+            else:
+                now = datetime.now(_UTC)
+                for p in SEED_PRODUCTS:
+                    await db["product"].update_one(
+                        {"title": p["title"]},
+                        {"$setOnInsert": {**p, "created_at": now, "updated_at": now}},
+                        upsert=True,
+                    )
+            invalidate_products_cache()
+    except Exception:
+        logger.exception("Product seeding failed; starting without it")
+
+
+# (monotonic timestamp, JSON body, gzipped body or None) of the last catalog read; per worker
+PRODUCTS_CACHE_TTL = 60.0
+_products_cache: Optional[Tuple[float, bytes, Optional[bytes]]] = None
+_products_lock = asyncio.Lock()
+
+
+def invalidate_products_cache():
+    """Drop the cached catalog; call after any product write."""
+    global _products_cache
+    _products_cache = None
+
+
+@app.get("/api/products", response_model=List[dict])
+async def list_products(request: Request) -> Response:
+    """Return the product catalog, served from memory for PRODUCTS_CACHE_TTL seconds."""
+    global _products_cache
+    if db is None:
+        return Response(content=b"[]", media_type="application/json")
+    cache = _products_cache
+    if cache is None or time.monotonic() - cache[0] >= PRODUCTS_CACHE_TTL:
+        # one refresh at a time; waiters reuse the result instead of hitting Mongo too
+        async with _products_lock:
+            cache = _products_cache
+            if cache is None or time.monotonic() - cache[0] >= PRODUCTS_CACHE_TTL:
+                products = await aggregate_documents("product", ID_AS_STRING)
+                body = orjson.dumps(products)
+                # compress once here; GZipMiddleware passes responses with Content-Encoding through
+                gzipped = gzip.compress(body) if len(body) >= GZIP_MIN_SIZE else None
+                cache = _products_cache = (time.monotonic(), body, gzipped)
+    _, body, gzipped = cache
+    if gzipped is not None and "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(
+            content=gzipped,
+            media_type="application/json",
+            headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"},
+        )
+    return Response(content=body, media_type="application/json")
 
 
 @app.post("/api/order")
-def create_order(order: OrderRequest):
+async def create_order(order: OrderRequest):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not available")
     # verify product exists
-    from bson import ObjectId
-
-    try:
-        product = db["product"].find_one({"_id": ObjectId(order.product_id)})
-    except Exception:
-        product = None
-
+    product = await db["product"].find_one({"_id": ObjectId(order.product_id)})
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
@@ -133,91 +231,147 @@ def create_order(order: OrderRequest):
         "total": total,
         "status": "created",
     }
-    oid = create_document("order", doc)
+    oid = await create_document("order", doc)
     return {"order_id": oid, "total": total, "status": "created"}
 
 
 # -------- Chat (AI Nutritional Therapist) --------
 
+GOAL_KEYWORDS = {
+    "weight loss": ("weight loss", "lose weight", "fat loss"),
+    "muscle gain": ("muscle", "gain weight", "bulk"),
+    "energy": ("energy", "tired", "fatigue"),
+    "gut health": ("ibs", "gut", "bloat"),
+}
+_KEYWORD_GOAL = {k: goal for goal, keywords in GOAL_KEYWORDS.items() for k in keywords}
+# Zero-width lookahead so overlapping keywords ("gain weight loss") all match
+_GOAL_RE = re.compile("(?=(%s))" % "|".join(re.escape(k) for k in _KEYWORD_GOAL))
+
+_INTRO = "Thanks for sharing. I'm your AI nutritional therapist."
+_GENERAL = "General guidance: focus on whole foods, 25–35g protein per meal, plenty of colorful veg, and hydrate."
+_BREAKFAST = "For breakfast, try Greek yogurt with berries and nuts, or eggs with spinach and wholegrain toast."
+_VEGAN = "For a vegan approach, prioritize legumes, tofu/tempeh, whole grains, seeds, and B12-fortified foods."
+_PLAN = "I can also create a tailored 7‑day meal plan if you share preferences, allergies, and budget."
+_CLOSING = (
+    "Would you like me to estimate your daily calorie target and macros based on age, height, weight, sex, activity?"
+)
+# Reply when no goal or topic keyword appears
+_DEFAULT_REPLY = " ".join([_INTRO, _GENERAL, _CLOSING])
+
+
+# Only short messages are memoized, so the cache cannot pin large client-supplied strings
+REPLY_CACHE_MAX_TEXT = 256
+
+
 def generate_nutrition_reply(user_text: str) -> str:
-    text = user_text.lower()
-    goals = []
-    if any(k in text for k in ["weight loss", "lose weight", "fat loss"]):
-        goals.append("weight loss")
-    if any(k in text for k in ["muscle", "gain weight", "bulk"]):
-        goals.append("muscle gain")
-    if any(k in text for k in ["energy", "tired", "fatigue"]):
-        goals.append("energy")
-    if any(k in text for k in ["ibs", "gut", "bloat"]):
-        goals.append("gut health")
-
-    parts = [
-        "Thanks for sharing. I'm your AI nutritional therapist.",
-    ]
-    if goals:
+    text = user_text.lower().strip()
+    if len(text) > REPLY_CACHE_MAX_TEXT:
+        return _build_reply(text)
+    return _cached_reply(text)
+
+
+def _build_reply(text: str) -> str:
+    """Build the reply for already-normalized text; pure, so safe to memoize."""
+    found = {_KEYWORD_GOAL[m.group(1)] for m in _GOAL_RE.finditer(text)}
+    breakfast = "breakfast" in text
+    vegan = "vegan" in text
+    plan = "plan" in text  # also covers "meal plan"
+    if not (found or breakfast or vegan or plan):
+        return _DEFAULT_REPLY
+
+    parts = [_INTRO]
+    if found:
+        goals = [g for g in GOAL_KEYWORDS if g in found]
         parts.append(f"I detect goals around {', '.join(goals)}.")
-    parts.append(
-        "General guidance: focus on whole foods, 25–35g protein per meal, plenty of colorful veg, and hydrate."
-    )
-    if "breakfast" in text:
-        parts.append(
-            "For breakfast, try Greek yogurt with berries and nuts, or eggs with spinach and wholegrain toast."
-        )
-    if "vegan" in text:
-        parts.append(
-            "For a vegan approach, prioritize legumes, tofu/tempeh, whole grains, seeds, and B12-fortified foods."
-        )
-    if "meal plan" in text or "plan" in text:
-        parts.append("I can also create a tailored 7‑day meal plan if you share preferences, allergies, and budget.")
-    parts.append(
-        "Would you like me to estimate your daily calorie target and macros based on age, height, weight, sex, activity?"
-    )
-    return " " .join(parts)
+    parts.append(_GENERAL)
+    if breakfast:
+        parts.append(_BREAKFAST)
+    if vegan:
+        parts.append(_VEGAN)
+    if plan:
+        parts.append(_PLAN)
+    parts.append(_CLOSING)
+    return " ".join(parts)
 
 
-@app.post("/api/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
-    if not req.message.strip():
-        raise HTTPException(status_code=400, detail="Message cannot be empty")
+_cached_reply = lru_cache(maxsize=4096)(_build_reply)
+
+
+class _RandPool(threading.local):
+    """Per-thread buffer of OS randomness, refilled 4KB at a time."""
+
+    def __init__(self, size: int = 4096):
+        self.size = size
+        self.buf = b""
+        self.pos = 0
+
+    def next_session_id(self) -> str:
+        if self.pos + 8 > len(self.buf):
+            self.buf = os.urandom(self.size)
+            self.pos = 0
+        sid = self.buf[self.pos:self.pos + 8].hex()
+        self.pos += 8
+        return sid
 
-    session_id = req.session_id or os.urandom(8).hex()
+
+_rand_pool = _RandPool()
+
+
+@app.post("/api/chat", response_model=ChatResponse)
+async def chat(req: ChatRequest):
+    session_id = req.session_id or _rand_pool.next_session_id()
     reply = generate_nutrition_reply(req.message)
 
     if db is not None:
-        # store both user and assistant messages
-        create_document(
-            "message",
-            {
-                "session_id": session_id,
-                "role": "user",
-                "content": req.message,
-            },
-        )
-        create_document(
+        # store both user and assistant messages in one round-trip
+        await create_documents(
             "message",
-            {
-                "session_id": session_id,
-                "role": "assistant",
-                "content": reply,
-            },
+            [
+                {
+                    "session_id": session_id,
+                    "role": "user",
+                    "content": req.message,
+                },
+                {
+                    "session_id": session_id,
+                    "role": "assistant",
+                    "content": reply,
+                },
+            ],
+            ordered=False,
         )
 
-    return ChatResponse(reply=reply, session_id=session_id, timestamp=datetime.now(timezone.utc))
+    return ChatResponse(reply=reply, session_id=session_id, timestamp=datetime.now(_UTC).isoformat())
+
+
+@app.on_event("startup")
+async def create_message_indexes():
+    if db is None:
+        return
+    try:
+        await db["message"].create_index([("session_id", 1), ("_id", -1)])
+    except Exception:
+        logger.exception("Could not create message.session_id index; /api/messages will scan")
 
 
 @app.get("/api/messages")
-def get_messages(session_id: str, limit: int = 50):
+async def get_messages(session_id: str, limit: int = 50):
     if db is None:
         return []
-    msgs = get_documents("message", {"session_id": session_id}, limit)
-    for m in msgs:
-        if "_id" in m:
-            m["id"] = str(m.pop("_id"))
-    return msgs
+    # newest-first walks the (session_id, _id) index; flip back to chronological
+    pipeline = [{"$match": {"session_id": session_id}}, {"$sort": {"_id": -1}}]
+    if limit > 0:
+        pipeline.append({"$limit": limit})
+    pipeline += [{"$sort": {"_id": 1}}, *ID_AS_STRING]
+    msgs = await aggregate_documents("message", pipeline)
+    return ORJSONResponse(msgs)
 
 
 if __name__ == "__main__":
     import uvicorn
 
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # async workers: one per core is enough, and each holds its own Mongo pool
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+    # "auto" picks uvloop/httptools when installed (uvicorn[standard]), else asyncio/h11
+    uvicorn.run("main:app", host="0.0.0.0", port=port, workers=workers, loop="auto", http="auto")
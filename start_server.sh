@@ -15,5 +15,6 @@ mkdir -p logs
 echo "Installing dependencies..."
 pip install -r requirements.txt
 echo "Starting FastAPI server..."
-nohup uvicorn main:app --host 0.0.0.0 --port 8000 --reload > logs/server.log 2>&1 
+WORKERS=${WEB_CONCURRENCY:-$(nproc)}
+nohup uvicorn main:app --host 0.0.0.0 --port 8000 --workers $WORKERS > logs/server.log 2>&1 
 echo "Server started in background"